@@ -3,8 +3,9 @@
 DRM-master.py (unido)
 - Reproductor integrado con python-vlc (para MPD no cifrados).
 - Si se proporciona KID:KEY, usa ffplay/ffmpeg para reproducir/grabar Widevine:
-    - Reproducir: ffplay -cenc_decryption_key KEY -i "MPD_URL"
-    - Grabar:   ffmpeg -cenc_decryption_key KEY -i "MPD_URL" -map 0:v:0 -map 0:a -c copy -f mpegts out.ts
+    - Reproducir: ffplay -probesize 32 -analyzeduration 500000 -cenc_decryption_key KEY -i "MPD_URL"
+    - Grabar:   ffmpeg -cenc_decryption_key KEY -i "MPD_URL" -map 0:v:0 -map 0:a -c copy -f mp4 -movflags +frag_keyframe+empty_moov out.mp4
+                (o -f mpegts out.ts con "Compatibilidad (TS)")
 - Mantiene screen-record (ffmpeg region capture) como en el original.
 LEGAL: No se proporciona ayuda para eludir protecciones. Usa sólo con permisos.
 """
@@ -15,47 +16,245 @@ import subprocess
 import signal
 import os
 import platform
+import functools
+import threading
+import time
+import urllib.request
 from pathlib import Path
 from PyQt6 import QtWidgets, QtGui, QtCore
 import vlc
 
 APP_NAME = "DRM-master"
+MEDIA_CACHE_SIZE = 8
+NETWORK_CACHING_MS = 300  # libVLC input buffer (default 1000 ms)
+
+# screen-record H.264 encoders, best first; libx264 is the always-available fallback
+HW_H264_ENCODERS = ("h264_nvenc", "h264_qsv", "h264_videotoolbox")
+SCREEN_ENCODER_OPTS = {
+    "h264_nvenc": ["-preset", "p1", "-tune", "ll", "-cq", "28"],
+    "h264_qsv": ["-preset", "veryfast"],
+    "h264_videotoolbox": ["-realtime", "1"],
+    "libx264": [
+        "-preset", "ultrafast",
+        "-tune", "zerolatency",
+        "-crf", "23",
+        "-x264-params", "sliced-threads=1:sync-lookahead=0:rc-lookahead=0",
+    ],
+}
+# -pix_fmt forced on the encoder input (default yuv420p). None: feed the grabber's
+# native bgr0/bgra and let the encoder convert (nvenc does RGB->YUV on the GPU)
+SCREEN_ENCODER_PIX_FMT = {"h264_nvenc": None, "h264_qsv": "nv12", "h264_videotoolbox": "nv12"}
+# capture input buffering: absorbs bursts instead of dropping frames (which forces extra I-frames)
+CAPTURE_INPUT_OPTS = ["-thread_queue_size", "1024", "-rtbufsize", "256M"]
+
+# manifest URLs that usually point to low-latency DASH (LL-DASH / CMAF chunked)
+LOW_LATENCY_MPD_RE = re.compile(r"low[-_]?latency|[/_.-]ll[/_.-]|chunked|cmaf", re.IGNORECASE)
+
+@functools.lru_cache(maxsize=4096)
+def _fmt(s: int) -> str:
+    # pure HH:MM:SS / MM:SS formatter, memoized per whole second
+    h = s // 3600
+    m = (s % 3600) // 60
+    sec = s % 60
+    if h:
+        return f"{h:02d}:{m:02d}:{sec:02d}"
+    return f"{m:02d}:{sec:02d}"
+
+class ProcRunner(QtCore.QObject):
+    """
+    Launch/stop an external process (ffplay/ffmpeg) without blocking the GUI thread.
+    Popen runs on a short-lived daemon thread (never queued behind the startup probes
+    in the global QThreadPool) in its own process group/session; stop()
+    first writes quit_input to stdin if given (ffmpeg "q" -> writes the trailer),
+    then signals/terminates and polls with QTimer (no wait()), escalating to
+    kill() once the deadline passes.
+    """
+    started = QtCore.pyqtSignal(int)
+    failed = QtCore.pyqtSignal(str)
+    stopped = QtCore.pyqtSignal()
+
+    POLL_MS = 100
+
+    def __init__(self, cmd, parent=None, quit_input=None, **popen_kwargs):
+        super().__init__(parent)
+        self.cmd = cmd
+        self.quit_input = quit_input
+        if quit_input is not None:
+            popen_kwargs.setdefault("stdin", subprocess.PIPE)
+        # own group/session so CTRL_BREAK/SIGTERM reach only this tool (and its children)
+        if sys.platform == "win32":
+            popen_kwargs.setdefault("creationflags", subprocess.CREATE_NEW_PROCESS_GROUP)
+        else:
+            popen_kwargs.setdefault("start_new_session", True)
+        self.popen_kwargs = popen_kwargs
+        self.proc = None
+        self._stop_pending = None
+        self._stopping = False
+        self._sig = None
+        self._signalled = False
+        self._signal_at = 0.0
+        self._deadline = 0.0
+        # started is emitted from the spawn thread -> queued back onto the GUI thread
+        self.started.connect(self._on_started)
+        self.failed.connect(self.deleteLater)
+        self.stopped.connect(self.deleteLater)
+
+    def start(self):
+        threading.Thread(target=self._spawn, daemon=True).start()
+
+    def _spawn(self):
+        try:
+            self.proc = subprocess.Popen(self.cmd, **self.popen_kwargs)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.started.emit(self.proc.pid)
+
+    def _on_started(self, pid):
+        # stop() was requested while Popen was still in flight
+        if self._stop_pending is not None:
+            self.stop(*self._stop_pending)
+
+    def stop(self, timeout_ms=3000, sig=None):
+        if self.proc is None:
+            self._stop_pending = (timeout_ms, sig)
+            return
+        if self._stopping:
+            return
+        self._stopping = True
+        self._stop_pending = None
+        self._sig = sig
+        self._signalled = False
+        now = time.monotonic()
+        self._deadline = now + timeout_ms / 1000.0
+        self._signal_at = now
+        if self.quit_input is not None and self.proc.stdin:
+            # give the tool half the deadline to quit on its own before signalling
+            try:
+                self.proc.stdin.write(self.quit_input)
+                self.proc.stdin.close()
+                self._signal_at = now + timeout_ms / 2000.0
+            except Exception:
+                pass
+        # first poll goes through the event loop too, so stopped is never emitted
+        # synchronously from inside stop() (callers can still update their state after it)
+        QtCore.QTimer.singleShot(0, self._poll_stop)
+
+    def _send_stop_signal(self):
+        self._signalled = True
+        try:
+            if self._sig is not None:
+                self.proc.send_signal(self._sig)
+            else:
+                self.proc.terminate()
+        except Exception:
+            pass
+
+    def _poll_stop(self):
+        if self.proc.poll() is not None:
+            self.stopped.emit()
+            return
+        now = time.monotonic()
+        if not self._signalled and now >= self._signal_at:
+            self._send_stop_signal()
+        if now >= self._deadline:
+            try:
+                self.proc.kill()
+            except Exception:
+                pass
+            self.stopped.emit()
+            return
+        QtCore.QTimer.singleShot(self.POLL_MS, self._poll_stop)
+
 
 class DRMMaster(QtWidgets.QMainWindow):
+    # libVLC position events arrive on a libVLC thread; re-emitted to reach the GUI thread
+    vlc_position_changed = QtCore.pyqtSignal(float)
+    # (url, fetched ok, looks like LL-DASH) from the background prefetch
+    manifest_prefetched = QtCore.pyqtSignal(str, bool, bool)
+    # background tool probing finished: (screen encoder, ddagrab available)
+    tools_detected = QtCore.pyqtSignal(str, bool)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle(APP_NAME)
         self.setMinimumSize(900, 550)
 
         # VLC player (integrated fallback for non-DRM)
-        self.instance = vlc.Instance()
+        self.instance = vlc.Instance(f"--network-caching={NETWORK_CACHING_MS}")
         self.player = self.instance.media_player_new()
+        self._attached_wid = None  # window handle currently bound to the player
 
         # Recording states
         self.recording = False
         self.record_path = None
 
+        # vlc.Media reuse: (url, sout or None) -> Media, plus the pair for the current play
+        self._media_cache = {}
+        self._media_plain = None
+        self._media_rec = None
+
+        # .mpd prefetch (warms the OS DNS cache and the CDN edge before Play): url -> low-latency flag
+        self._manifest_low_latency = {}
+        self._prefetching = set()
+
         # Screen-record (ffmpeg) state
         self.screen_rec_process = None
         self.screen_rec_path = None
         self.screen_rec_framerate = 25
+        self._screen_encoder = "libx264"  # upgraded to a hw encoder once _prewarm_tools reports back
+        self._has_ddagrab = False  # Windows Desktop Duplication source (ffmpeg >= 6.0)
+        # OS-dependent screen-record args, computed once; per click only geometry is filled in
+        self._screen_system = platform.system()
+        self._display = os.environ.get("DISPLAY", ":0.0")
+        self._screen_templates = None
+        self._ddagrab_templates = None  # Windows + ddagrab only; used when the frame is on the primary screen
 
-        # FFmpeg/ffplay processes for Widevine
+        # FFmpeg/ffplay processes for Widevine (ProcRunner instances while active)
         self.ffplay_proc = None
         self.ffmpeg_rec_proc = None  # for recording via ffmpeg when KEY provided
+        self._closing_runners = []  # runners closeEvent is waiting on
+
+        # Resolved ffplay/ffmpeg paths (cached; refreshed via "Volver a buscar herramientas")
+        self._ffplay = None
+        self._ffmpeg = None
+        self._tools_warmed = threading.Event()
+        self.tools_detected.connect(self._on_tools_detected)
+        self._resolve_tools()
+        self._prewarm_tools()
+        self._rebuild_screen_templates()
 
         # UI
         self._build_ui()
         self._connect_signals()
 
-        # UI update timer (for integrated player)
+        # Slider follows libVLC position events (no polling)
+        self._slider_dragging = False
+        self._last_total_sec = None
+        self._last_total_fmt = ""
+        self._last_label_pair = (0, 0)
+        # length/time pushed by libVLC events: the label/slider code reads these, never the player
+        self._length_ms = 0
+        self._time_ms = 0
+        self._slider_move_pending = False
+        self._slider_move_value = 0
+        self.vlc_position_changed.connect(self._apply_ui)
+        em = self.player.event_manager()
+        em.event_attach(vlc.EventType.MediaPlayerPositionChanged, self._on_vlc_position)
+        em.event_attach(vlc.EventType.MediaPlayerMediaChanged, self._on_vlc_media_changed)
+        em.event_attach(vlc.EventType.MediaPlayerLengthChanged, self._on_vlc_length_changed)
+        em.event_attach(vlc.EventType.MediaPlayerTimeChanged, self._on_vlc_time_changed)
+
+        # 1 Hz timer only for the time_label text (for integrated player)
         self.timer = QtCore.QTimer(self)
-        self.timer.setInterval(500)
-        self.timer.timeout.connect(self.update_ui)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.update_time_label)
 
     def _build_ui(self):
         central = QtWidgets.QWidget()
         self.setCentralWidget(central)
+        tools_menu = self.menuBar().addMenu("Herramientas")
+        self.rescan_action = tools_menu.addAction("Volver a buscar ffmpeg/ffplay")
         layout = QtWidgets.QVBoxLayout(central)
         layout.setContentsMargins(8,8,8,8)
 
@@ -69,6 +268,9 @@ class DRMMaster(QtWidgets.QMainWindow):
         form.addWidget(self.url_edit)
         form.addWidget(QtWidgets.QLabel("KID:KEY:"))
         form.addWidget(self.kidkey_edit)
+        self.low_latency_chk = QtWidgets.QCheckBox("Baja latencia")
+        self.low_latency_chk.setToolTip("ffplay sin buffer de entrada (-fflags nobuffer). Puede degradar la calidad en algunos streams.")
+        form.addWidget(self.low_latency_chk)
         layout.addLayout(form)
 
         # Video frame
@@ -88,6 +290,12 @@ class DRMMaster(QtWidgets.QMainWindow):
         controls.addWidget(self.pause_btn)
         controls.addWidget(self.stop_btn)
         controls.addWidget(self.record_btn)
+        self.ts_compat_chk = QtWidgets.QCheckBox("Compatibilidad (TS)")
+        self.ts_compat_chk.setToolTip("Grabar Widevine en MPEG-TS (.ts) en lugar de MP4 fragmentado.")
+        controls.addWidget(self.ts_compat_chk)
+        self.rec_screen_too_chk = QtWidgets.QCheckBox("+ Pantalla")
+        self.rec_screen_too_chk.setToolTip("Con KID:KEY, grabar también la pantalla (<nombre>_screen.mp4) con el mismo proceso ffmpeg.")
+        controls.addWidget(self.rec_screen_too_chk)
         controls.addWidget(self.screen_rec_btn)
 
         self.time_label = QtWidgets.QLabel("00:00 / 00:00")
@@ -109,42 +317,199 @@ class DRMMaster(QtWidgets.QMainWindow):
         self.stop_btn.clicked.connect(self.on_stop)
         self.record_btn.clicked.connect(self.on_record)
         self.screen_rec_btn.clicked.connect(self.on_screen_record)
+        self.rescan_action.triggered.connect(self.on_rescan_tools)
         self.position_slider.sliderPressed.connect(self.on_slider_press)
         self.position_slider.sliderReleased.connect(self.on_slider_release)
         self.position_slider.sliderMoved.connect(self.on_slider_move)
+        self.url_edit.editingFinished.connect(self.on_url_edited)
+        self.manifest_prefetched.connect(self._on_manifest_prefetched)
         self.kidkey_edit.returnPressed.connect(lambda: self.status.setText("KID:KEY guardado (se usará si es necesario)."))
         self.installEventFilter(self)
 
     # ---------------- helpers ----------------
     
 
+    def validate_mpd(self, url: str) -> bool:
+        return ".mpd" in url.lower()
+
     def extract_key_after_colon(self, kidkey: str) -> str:
         if ":" in kidkey:
             return kidkey.split(":", 1)[1].strip()
         return ""
 
+    def on_url_edited(self):
+        url = self.url_edit.text().strip()
+        # enable low-latency by default for LL-DASH looking manifests (never auto-disable)
+        if LOW_LATENCY_MPD_RE.search(url):
+            self.low_latency_chk.setChecked(True)
+        self._prefetch_manifest(url)
+
+    def _prefetch_manifest(self, url: str):
+        # fetch the manifest off the GUI thread: the OS resolver cache and the CDN edge are warm
+        # when Play is pressed (ffplay/ffmpeg still open their own TCP/TLS connections)
+        if not url.lower().startswith(("http://", "https://")):
+            return
+        if url in self._manifest_low_latency or url in self._prefetching:
+            return
+        self._prefetching.add(url)
+
+        def fetch():
+            try:
+                with urllib.request.urlopen(url, timeout=5) as resp:
+                    data = resp.read()
+            except Exception:
+                self.manifest_prefetched.emit(url, False, False)
+                return
+            # LL-DASH manifests announce themselves (availabilityTimeOffset / <Latency>)
+            low_latency = b"availabilityTimeOffset" in data or b"<Latency" in data
+            self.manifest_prefetched.emit(url, True, low_latency)
+
+        # daemon thread: a slow CDN must not hold up ProcRunner spawns or application exit
+        threading.Thread(target=fetch, daemon=True).start()
+
+    def _on_manifest_prefetched(self, url, ok, low_latency):
+        self._prefetching.discard(url)
+        if not ok:
+            return
+        self._manifest_low_latency[url] = low_latency
+        if low_latency and url == self.url_edit.text().strip():
+            self.low_latency_chk.setChecked(True)
+
+    def _http_input_opts(self, url: str):
+        # keep-alive + reconnect for http(s) inputs; other protocols would reject these options.
+        # These only apply to the manifest GET: the dash demuxer forwards just headers, user_agent,
+        # cookies, proxy, referer and rw_timeout to the segment requests.
+        if not url.lower().startswith(("http://", "https://")):
+            return []
+        return ["-reconnect", "1", "-reconnect_streamed", "1", "-multiple_requests", "1"]
+
+    def _build_ffplay_cmd(self, key: str, url: str):
+        # small probe + 0.5s analysis so the first frame isn't delayed by ~5s of stream analysis
+        # (-analyzeduration 0 would mean "use the 5s default")
+        cmd = [
+            self._ffplay,
+            "-hide_banner",
+            "-loglevel", "error",
+            "-probesize", "32",
+            "-analyzeduration", "500000",
+        ]
+        if self.low_latency_chk.isChecked():
+            cmd += [
+                "-fflags", "nobuffer+genpts+discardcorrupt",
+                "-flags", "low_delay",
+                "-strict", "experimental",
+                "-sync", "ext",
+            ]
+        else:
+            cmd += ["-fflags", "+genpts+discardcorrupt"]
+        cmd += self._http_input_opts(url)
+        cmd += ["-cenc_decryption_key", key, "-i", url]
+        return cmd
+
+    def _get_media(self, url: str, sout_opt=None):
+        # reuse the Media built for this (url, sout) instead of creating a new one per toggle
+        key = (url, sout_opt)
+        media = self._media_cache.pop(key, None)
+        if media is None:
+            media = self.instance.media_new(url, sout_opt) if sout_opt else self.instance.media_new(url)
+            self._evict_media()
+        # (re)insert at the end: dict order is least -> most recently used
+        self._media_cache[key] = media
+        return media
+
+    def _evict_media(self):
+        # drop least recently used entries, never the plain/rec media of the current play
+        pinned = (self._media_plain, self._media_rec)
+        for old_key in list(self._media_cache):
+            if len(self._media_cache) < MEDIA_CACHE_SIZE:
+                break
+            if any(self._media_cache[old_key] is m for m in pinned):
+                continue
+            self._media_cache.pop(old_key).release()
+
     def make_media_with_recording(self, url: str, outpath: Path):
-        out = str(outpath.resolve())
+        out = str(outpath)
         # sout to duplicate: display + file (mp4)
         sout_opt = f":sout=#duplicate{{dst=display,dst=std{{access=file,mux=mp4,dst={out}}}}}"
-        media = self.instance.media_new(url, sout_opt)
-        return media
+        return self._get_media(url, sout_opt)
 
     def attach_video(self):
+        # rebinding the same handle makes libVLC reinit the video output (black flash),
+        # and before the frame is shown Qt may hand out 0 / the parent's handle
+        if not self.video_frame.isVisible():
+            return
+        wid = int(self.video_frame.winId())
+        if not wid or wid == self._attached_wid:
+            return
         if sys.platform.startswith("linux"):
-            self.player.set_xwindow(self.video_frame.winId())
+            self.player.set_xwindow(wid)
         elif sys.platform == "win32":
-            self.player.set_hwnd(self.video_frame.winId())
+            self.player.set_hwnd(wid)
         elif sys.platform == "darwin":
-            self.player.set_nsobject(int(self.video_frame.winId()))
+            self.player.set_nsobject(wid)
         else:
-            self.player.set_hwnd(self.video_frame.winId())
+            self.player.set_hwnd(wid)
+        self._attached_wid = wid
+
+    def _resolve_tools(self):
+        # absolute paths so Popen doesn't walk PATH (or PATHEXT on Windows) per spawn
+        self._ffplay = shutil_which("ffplay")
+        self._ffmpeg = shutil_which("ffmpeg")
+
+    def _prewarm_tools(self):
+        # run each tool once off the GUI thread so the OS caches the binaries
+        # and libav* libraries before the first Play/Record click
+        self._tools_warmed.clear()
+        cmds = []
+        if self._ffmpeg:
+            cmds.append([self._ffmpeg, "-hide_banner", "-version"])
+        if self._ffplay:
+            cmds.append([self._ffplay, "-hide_banner", "-version"])
+        ffprobe = shutil_which("ffprobe")
+        if ffprobe:
+            cmds.append([ffprobe, "-v", "quiet", "-show_format", os.devnull])
+        # the worker thread only sees these locals; results go back through tools_detected
+        ffmpeg = self._ffmpeg
+        windows = self._screen_system == "Windows"
+
+        def warm():
+            for cmd in cmds:
+                try:
+                    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=5)
+                except Exception:
+                    pass
+            encoder, has_ddagrab = "libx264", False
+            if ffmpeg:
+                encoder = detect_h264_encoder(ffmpeg)
+                if windows:
+                    has_ddagrab = ffmpeg_has_filter(ffmpeg, "ddagrab")
+            self._tools_warmed.set()
+            self.tools_detected.emit(encoder, has_ddagrab)
+
+        # daemon thread, not the global QThreadPool: the probes can take seconds and Qt
+        # waits for the global pool on exit
+        threading.Thread(target=warm, daemon=True).start()
+
+    def _on_tools_detected(self, encoder, has_ddagrab):
+        # GUI thread: store the probe results and rebuild the screen-record templates once
+        self._screen_encoder = encoder
+        self._has_ddagrab = has_ddagrab
+        self._rebuild_screen_templates()
 
     def ffplay_available(self):
-        return shutil_which("ffplay") is not None
+        return self._ffplay is not None
 
     def ffmpeg_available(self):
-        return shutil_which("ffmpeg") is not None
+        return self._ffmpeg is not None
+
+    def on_rescan_tools(self):
+        shutil_which.cache_clear()
+        _dir_cache.clear()
+        detect_h264_encoder.cache_clear()
+        ffmpeg_has_filter.cache_clear()
+        self._resolve_tools()
+        self._prewarm_tools()
+        self.status.setText(f"ffplay: {self._ffplay or 'no encontrado'} | ffmpeg: {self._ffmpeg or 'no encontrado'}")
 
     # ---------------- actions ----------------
     def on_play(self):
@@ -157,20 +522,19 @@ class DRMMaster(QtWidgets.QMainWindow):
         # If there's a KEY use ffplay to play Widevine; else use integrated libVLC
         if key:
             # Use ffplay (external window) for Widevine decryption playback
-            if shutil_which("ffplay") is None:
+            if not self.ffplay_available():
                 QtWidgets.QMessageBox.warning(self, "ffplay no encontrado", "No se encuentra 'ffplay' en PATH. Instala ffmpeg (incluye ffplay).")
                 return
             if self.ffplay_proc:
                 self.status.setText("ffplay ya está reproduciendo.")
                 return
-            cmd = ["ffplay", "-loglevel", "error", "-cenc_decryption_key", key, "-i", url]
-            try:
-                # start ffplay; it will open its own video window
-                self.ffplay_proc = subprocess.Popen(cmd)
-                self.status.setText(f"Reproduciendo con ffplay (Widevine). PID: {self.ffplay_proc.pid}")
-            except Exception as e:
-                QtWidgets.QMessageBox.warning(self, "Error ffplay", f"No se pudo iniciar ffplay: {e}")
-                self.ffplay_proc = None
+            cmd = self._build_ffplay_cmd(key, url)
+            # start ffplay off the GUI thread; it will open its own video window
+            self.ffplay_proc = ProcRunner(cmd, self)
+            self.ffplay_proc.started.connect(self._on_ffplay_started)
+            self.ffplay_proc.failed.connect(self._on_ffplay_failed)
+            self.ffplay_proc.start()
+            self.status.setText("Iniciando ffplay (Widevine)...")
             return
 
         # else: integrated libVLC playback (for non-DRM MPD)
@@ -180,10 +544,12 @@ class DRMMaster(QtWidgets.QMainWindow):
             # there was input but no key (should not happen because above check), just show status
             self.status.setText("KID:KEY guardado como metadato (no se usa en libVLC).")
 
-        if self.recording and self.record_path:
-            media = self.make_media_with_recording(url, Path(self.record_path))
+        self._media_plain = self._get_media(url)
+        self._media_rec = self.make_media_with_recording(url, Path(self.record_path)) if self.record_path else None
+        if self.recording and self._media_rec is not None:
+            media = self._media_rec
         else:
-            media = self.instance.media_new(url)
+            media = self._media_plain
 
         self.player.set_media(media)
         self.attach_video()
@@ -211,31 +577,19 @@ class DRMMaster(QtWidgets.QMainWindow):
         self.timer.stop()
         self.position_slider.setValue(0)
         self.time_label.setText("00:00 / 00:00")
+        self._last_label_pair = (0, 0)
+        self._time_ms = 0
 
-        # stop ffplay if running
+        # stop ffplay if running (terminate now, kill after 3s; never blocks)
         if self.ffplay_proc:
-            try:
-                self.ffplay_proc.terminate()
-                self.ffplay_proc.wait(timeout=3)
-            except Exception:
-                try:
-                    self.ffplay_proc.kill()
-                except Exception:
-                    pass
+            self.ffplay_proc.stop(3000)
             self.ffplay_proc = None
-            self.status.setText("ffplay detenido.")
 
         # stop ffmpeg recording if active
         if self.ffmpeg_rec_proc:
-            try:
-                self.ffmpeg_rec_proc.terminate()
-                self.ffmpeg_rec_proc.wait(timeout=3)
-            except Exception:
-                try:
-                    self.ffmpeg_rec_proc.kill()
-                except Exception:
-                    pass
+            self.ffmpeg_rec_proc.stop(3000)
             self.ffmpeg_rec_proc = None
+            self.record_btn.setText("Record")
 
         # stop screen rec if active
         if self.screen_rec_process:
@@ -251,7 +605,7 @@ class DRMMaster(QtWidgets.QMainWindow):
     def on_record(self):
         """
         Dual behavior:
-         - If KID:KEY provided -> start/stop ffmpeg recording with -cenc_decryption_key (into .ts)
+         - If KID:KEY provided -> start/stop ffmpeg recording with -cenc_decryption_key (into fragmented .mp4, or .ts)
          - Else -> fallback to libVLC sout recording as before
         """
         url = self.url_edit.text().strip()
@@ -260,7 +614,7 @@ class DRMMaster(QtWidgets.QMainWindow):
 
         if key:
             # Use ffmpeg recording for Widevine
-            if shutil_which("ffmpeg") is None:
+            if not self.ffmpeg_available():
                 QtWidgets.QMessageBox.warning(self, "ffmpeg no encontrado", "No se encuentra 'ffmpeg' en PATH.")
                 return
             if not self.validate_mpd(url):
@@ -268,140 +622,218 @@ class DRMMaster(QtWidgets.QMainWindow):
                 return
 
             if self.ffmpeg_rec_proc:
-                # stop recording
-                try:
-                    self.ffmpeg_rec_proc.terminate()
-                    self.ffmpeg_rec_proc.wait(timeout=5)
-                except Exception:
-                    try:
-                        self.ffmpeg_rec_proc.kill()
-                    except Exception:
-                        pass
+                # stop recording; final status once ffmpeg has actually exited
+                path = self.record_path
+                self.status.setText("Deteniendo grabación ffmpeg...")
+                self.ffmpeg_rec_proc.stopped.connect(lambda: self.status.setText(f"Grabación ffmpeg detenida. Archivo: {path}"))
+                self.ffmpeg_rec_proc.stop(5000)
+                if self.screen_rec_process is self.ffmpeg_rec_proc:
+                    # combined process: the screen recording ends with it
+                    self.screen_rec_process = None
+                    self.screen_rec_btn.setText("Screen Rec")
                 self.ffmpeg_rec_proc = None
                 self.record_btn.setText("Record")
-                self.status.setText(f"Grabación ffmpeg detenida. Archivo: {self.record_path}")
                 return
 
-            # start recording: ask filename
-            fname, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Guardar grabación (ffmpeg) como", "", "TS files (*.ts);;All files (*)")
-            if not fname:
-                return
-            if not Path(fname).suffix:
-                fname = fname + ".ts"
-            self.record_path = fname
-            # build command (user's recommended)
-            cmd = [
-                "ffmpeg",
-                "-y",
-                "-loglevel", "error",
-                "-cenc_decryption_key", key,
-                "-i", url,
-                "-map", "0:v:0", "-map", "0:a",
-                "-c", "copy", "-f", "mpegts",
-                self.record_path
-            ]
-            try:
-                self.ffmpeg_rec_proc = subprocess.Popen(cmd)
-            except Exception as e:
-                QtWidgets.QMessageBox.warning(self, "Error al iniciar ffmpeg", f"No se pudo iniciar ffmpeg: {e}")
-                self.ffmpeg_rec_proc = None
-                return
-            self.record_btn.setText("Stop Rec")
-            self.status.setText(f"Grabando (ffmpeg) -> {self.record_path}")
+            # start recording: ask filename (non-modal, continues in _on_record_filename_chosen)
+            ts_compat = self.ts_compat_chk.isChecked()
+            if ts_compat:
+                filters, suffix = "TS files (*.ts);;All files (*)", ".ts"
+            else:
+                filters, suffix = "MP4 files (*.mp4);;All files (*)", ".mp4"
+            self._ask_save_path(
+                "Guardar grabación (ffmpeg) como", filters, suffix,
+                lambda path: self._on_record_filename_chosen(path, key, url, ts_compat),
+            )
             return
 
         # else fallback: original libVLC sout recording
         if not self.recording:
-            fname, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Guardar grabación (libVLC) como", "", "MP4 files (*.mp4);;All files (*)")
-            if not fname:
-                return
-            if not Path(fname).suffix:
-                fname = fname + ".mp4"
-            self.record_path = fname
-            self.recording = True
-            self.record_btn.setText("Stop Rec")
-            self.status.setText(f"Preparado para grabar por libVLC -> {self.record_path}")
-            # if already playing, restart with sout
-            if self.player.is_playing():
-                
-                self.player.stop()
-                media = self.make_media_with_recording(url, Path(self.record_path))
-                self.player.set_media(media)
-                self.attach_video()
-                self.player.play()
-                self.timer.start()
-                self.status.setText(f"Grabando (libVLC) -> {self.record_path}")
+            self._ask_save_path(
+                "Guardar grabación (libVLC) como", "MP4 files (*.mp4);;All files (*)", ".mp4",
+                lambda path: self._on_vlc_record_filename_chosen(path, url),
+            )
         else:
             # stop libVLC recording: restart playback without sout
             self.recording = False
             self.record_btn.setText("Record")
             if self.player.is_playing():
-                url = self.url_edit.text().strip()
-                self.player.stop()
-                media = self.instance.media_new(url)
-                self.player.set_media(media)
+                if self._media_plain is None:
+                    self._media_plain = self._get_media(url)
+                self.player.set_media(self._media_plain)
                 self.attach_video()
                 self.player.play()
                 self.status.setText(f"Grabación (libVLC) detenida. Archivo: {self.record_path}")
             else:
                 self.status.setText("Grabación (libVLC) cancelada.")
 
-    # ---------------- screen recording (ffmpeg) ----------------
-    def on_screen_record(self):
-        """Toggle screen recording with ffmpeg capturing video_frame region."""
-        if not self.screen_rec_process:
-            # start screen rec
-            fname, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Guardar grabación (screen) como", "", "MP4 files (*.mp4);;All files (*)")
+    def _ask_save_path(self, title, filters, default_suffix, on_chosen):
+        """
+        Non-modal save dialog (the video keeps repainting while it is open).
+        on_chosen receives the resolved path, with default_suffix added if missing.
+        """
+        dlg = QtWidgets.QFileDialog(self, title, "", filters)
+        dlg.setAcceptMode(QtWidgets.QFileDialog.AcceptMode.AcceptSave)
+        dlg.setAttribute(QtCore.Qt.WidgetAttribute.WA_DeleteOnClose)
+
+        def chosen(fname):
             if not fname:
                 return
             if not Path(fname).suffix:
-                fname = fname + ".mp4"
-            self.screen_rec_path = fname
-            # compute geometry of video_frame in global coordinates
+                fname = fname + default_suffix
+            on_chosen(str(Path(fname).resolve()))
+
+        dlg.fileSelected.connect(chosen)
+        dlg.open()
+
+    def _on_record_filename_chosen(self, path, key, url, ts_compat):
+        if self.ffmpeg_rec_proc:
+            return
+        self.record_path = path
+        stream_in, stream_out = self._stream_record_args(key, url, ts_compat)
+
+        if self.rec_screen_too_chk.isChecked() and not self.screen_rec_process:
+            # stream + screen in one ffmpeg: one libav init, one thread pool
             geo = self._get_video_frame_geometry()
-            if geo is None:
-                QtWidgets.QMessageBox.warning(self, "Error", "No se puede obtener la geometría de la ventana para screen-record.")
-                return
-            x, y, w, h = geo
-            cmd = self._build_ffmpeg_cmd_for_region(x, y, w, h, self.screen_rec_framerate, self.screen_rec_path)
-            if not cmd:
-                QtWidgets.QMessageBox.warning(self, "Unsupported OS", "Screen recording no soportado en este sistema.")
-                return
-            try:
-                # start ffmpeg as subprocess
-                # use shell=False with list args; keep stderr redirected for now
-                self.screen_rec_process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            except Exception as e:
-                QtWidgets.QMessageBox.warning(self, "Error al iniciar ffmpeg", f"No se pudo iniciar ffmpeg: {e}")
-                self.screen_rec_process = None
+            capture = self._screen_capture_args(*geo, self.screen_rec_framerate) if geo else None
+            if capture is None:
+                QtWidgets.QMessageBox.warning(self, "Error", "No se puede preparar el screen-record; se graba sólo el stream.")
+            else:
+                screen_in, screen_out = capture
+                p = Path(self.record_path)
+                self.screen_rec_path = str(p.with_name(f"{p.stem}_screen.mp4"))
+                self.ffmpeg_rec_proc = self._launch_combined_ffmpeg(
+                    [stream_in, screen_in],
+                    [(stream_out, self.record_path), (["-map", "1:v", *screen_out], self.screen_rec_path)],
+                    on_failed=self._on_combined_rec_failed,
+                )
+                self.screen_rec_process = self.ffmpeg_rec_proc
+                self.screen_rec_btn.setText("Stop ScreenRec")
+                self.record_btn.setText("Stop Rec")
+                self.status.setText(f"Grabando (ffmpeg) -> {self.record_path} + pantalla -> {self.screen_rec_path}")
                 return
-            self.screen_rec_btn.setText("Stop ScreenRec")
-            self.status.setText(f"Grabando pantalla -> {self.screen_rec_path}")
+
+        cmd = [
+            self._ffmpeg,
+            "-y",
+            "-hide_banner",
+            "-loglevel", "error",
+            *stream_in,
+            *stream_out,
+            self.record_path
+        ]
+        self.ffmpeg_rec_proc = ProcRunner(cmd, self, quit_input=b"q\n")
+        self.ffmpeg_rec_proc.started.connect(self._on_ffmpeg_rec_started)
+        self.ffmpeg_rec_proc.failed.connect(self._on_ffmpeg_rec_failed)
+        self.ffmpeg_rec_proc.start()
+        self.record_btn.setText("Stop Rec")
+        self.status.setText(f"Iniciando grabación (ffmpeg) -> {self.record_path}")
+
+    def _on_vlc_record_filename_chosen(self, path, url):
+        if self.recording:
+            return
+        self.record_path = path
+        self.recording = True
+        self.record_btn.setText("Stop Rec")
+        self.status.setText(f"Preparado para grabar por libVLC -> {self.record_path}")
+        # if already playing, swap to the cached sout media (set_media replaces the input, no stop())
+        if self.player.is_playing():
+            self._media_rec = self.make_media_with_recording(url, Path(self.record_path))
+            self.player.set_media(self._media_rec)
+            self.attach_video()
+            self.player.play()
+            self.timer.start()
+            self.status.setText(f"Grabando (libVLC) -> {self.record_path}")
+
+    # ---------------- screen recording (ffmpeg) ----------------
+    def on_screen_record(self):
+        """Toggle screen recording with ffmpeg capturing video_frame region."""
+        if not self.screen_rec_process:
+            # start screen rec: ask filename (non-modal, continues in _on_screen_record_filename_chosen)
+            self._ask_save_path(
+                "Guardar grabación (screen) como", "MP4 files (*.mp4);;All files (*)", ".mp4",
+                self._on_screen_record_filename_chosen,
+            )
         else:
             # stop
             self._stop_ffmpeg_screenrec()
             self.status.setText(f"Screen recording guardado en {self.screen_rec_path}")
 
+    def _on_screen_record_filename_chosen(self, path):
+        if self.screen_rec_process:
+            return
+        self.screen_rec_path = path
+        # compute geometry of video_frame in global coordinates
+        geo = self._get_video_frame_geometry()
+        if geo is None:
+            QtWidgets.QMessageBox.warning(self, "Error", "No se puede obtener la geometría de la ventana para screen-record.")
+            return
+        x, y, w, h = geo
+        cmd = self._build_ffmpeg_cmd_for_region(x, y, w, h, self.screen_rec_framerate, self.screen_rec_path)
+        if not cmd:
+            QtWidgets.QMessageBox.warning(self, "Unsupported OS", "Screen recording no soportado en este sistema.")
+            return
+        # start ffmpeg off the GUI thread
+        # use shell=False with list args; keep stderr redirected for now
+        self.screen_rec_process = ProcRunner(cmd, self, quit_input=b"q\n", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.screen_rec_process.failed.connect(self._on_screenrec_failed)
+        self.screen_rec_process.start()
+        self.screen_rec_btn.setText("Stop ScreenRec")
+        self.status.setText(f"Grabando pantalla -> {self.screen_rec_path}")
+
     def _stop_ffmpeg_screenrec(self):
         if self.screen_rec_process:
-            try:
-                # terminate process nicely
-                if platform.system() == "Windows":
-                    self.screen_rec_process.send_signal(signal.CTRL_BREAK_EVENT)
-                else:
-                    self.screen_rec_process.terminate()
-            except Exception:
-                pass
-            try:
-                self.screen_rec_process.wait(timeout=5)
-            except Exception:
-                try:
-                    self.screen_rec_process.kill()
-                except Exception:
-                    pass
+            # "q" on stdin first, then CTRL_BREAK/SIGTERM; ProcRunner kills it after 5s
+            sig = signal.CTRL_BREAK_EVENT if self._screen_system == "Windows" else None
+            self.screen_rec_process.stop(5000, sig)
+            if self.ffmpeg_rec_proc is self.screen_rec_process:
+                # combined process: the stream recording ends with it
+                self.ffmpeg_rec_proc = None
+                self.record_btn.setText("Record")
             self.screen_rec_process = None
             self.screen_rec_btn.setText("Screen Rec")
 
+    # ---------------- process callbacks ----------------
+    # signals are queued, so they can arrive after Stop/restart: only the current runner may touch state
+    def _on_ffplay_started(self, pid):
+        if self.sender() is not self.ffplay_proc:
+            return
+        self.status.setText(f"Reproduciendo con ffplay (Widevine). PID: {pid}")
+
+    def _on_ffplay_failed(self, err):
+        if self.sender() is not self.ffplay_proc:
+            return
+        self.ffplay_proc = None
+        QtWidgets.QMessageBox.warning(self, "Error ffplay", f"No se pudo iniciar ffplay: {err}")
+
+    def _on_ffmpeg_rec_started(self, pid):
+        if self.sender() is not self.ffmpeg_rec_proc:
+            return
+        self.status.setText(f"Grabando (ffmpeg) -> {self.record_path} PID: {pid}")
+
+    def _on_ffmpeg_rec_failed(self, err):
+        if self.sender() is not self.ffmpeg_rec_proc:
+            return
+        self.ffmpeg_rec_proc = None
+        self.record_btn.setText("Record")
+        QtWidgets.QMessageBox.warning(self, "Error al iniciar ffmpeg", f"No se pudo iniciar ffmpeg: {err}")
+
+    def _on_screenrec_failed(self, err):
+        if self.sender() is not self.screen_rec_process:
+            return
+        self.screen_rec_process = None
+        self.screen_rec_btn.setText("Screen Rec")
+        QtWidgets.QMessageBox.warning(self, "Error al iniciar ffmpeg", f"No se pudo iniciar ffmpeg: {err}")
+
+    def _on_combined_rec_failed(self, err):
+        if self.sender() is not self.ffmpeg_rec_proc:
+            return
+        self.ffmpeg_rec_proc = None
+        self.screen_rec_process = None
+        self.record_btn.setText("Record")
+        self.screen_rec_btn.setText("Screen Rec")
+        QtWidgets.QMessageBox.warning(self, "Error al iniciar ffmpeg", f"No se pudo iniciar ffmpeg: {err}")
+
     def _get_video_frame_geometry(self):
         """
         Return (x, y, w, h) in global screen coords for the video_frame content area.
@@ -419,124 +851,328 @@ class DRMMaster(QtWidgets.QMainWindow):
     def _build_ffmpeg_cmd_for_region(self, x, y, w, h, framerate, outpath):
         """
         Build ffmpeg command (list) to record region (x,y,w,h) according to OS.
+        outpath is expected to be already resolved (done when the file dialog closes).
+        """
+        capture = self._screen_capture_args(x, y, w, h, framerate)
+        if capture is None:
+            return None
+        input_args, output_args = capture
+        return [self._ffmpeg or "ffmpeg", "-y", *input_args, *output_args, str(outpath)]
+
+    def _screen_capture_args(self, x, y, w, h, framerate):
+        """
+        Return (input_args, output_args) capturing region (x,y,w,h) according to OS,
+        or None if unsupported. output_args carry the filter + encoder options.
+        """
+        templates = self._screen_templates
+        if self._ddagrab_templates is not None:
+            # ddagrab offsets are relative to the captured monitor (output_idx=0, the primary one),
+            # while mapToGlobal gives virtual-desktop coords: use it only when the region lies
+            # entirely on the primary screen, else keep gdigrab
+            primary = QtGui.QGuiApplication.primaryScreen()
+            if primary is not None and primary.geometry().contains(QtCore.QRect(x, y, w, h)):
+                origin = primary.geometry().topLeft()
+                x, y = x - origin.x(), y - origin.y()
+                templates = self._ddagrab_templates
+        if templates is None:
+            return None
+        input_tpl, output_tpl = templates
+        values = {"x": x, "y": y, "w": w, "h": h, "fps": framerate, "gop": framerate * 2}
+        return [a.format(**values) for a in input_tpl], [a.format(**values) for a in output_tpl]
+
+    def _rebuild_screen_templates(self):
+        self._screen_templates = self._build_screen_templates()
+        self._ddagrab_templates = self._build_ddagrab_templates()
+
+    def _build_ddagrab_templates(self):
+        """
+        Windows Desktop Duplication templates, or None without ddagrab.
+        {x} {y} must be relative to the primary monitor (output_idx=0).
+        """
+        if self._screen_system != "Windows" or not self._has_ddagrab:
+            return None
+        # frames stay on the GPU (D3D11); nvenc takes them directly,
+        # other encoders need them downloaded first
+        gpu_frames = self._screen_encoder == "h264_nvenc"
+        src = "ddagrab=output_idx=0:framerate={fps}:offset_x={x}:offset_y={y}:video_size={w}x{h}"
+        input_tpl = ["-f", "lavfi", *CAPTURE_INPUT_OPTS, "-i", src]
+        output_tpl = [
+            *([] if gpu_frames else ["-vf", "hwdownload,format=bgra"]),
+            *self._screen_encode_args(gpu_frames),
+        ]
+        return input_tpl, output_tpl
+
+    def _build_screen_templates(self):
+        """
+        Precompute (input_template, output_template) for the current OS/encoder.
+        Geometry and framerate are str.format placeholders: {x} {y} {w} {h} {fps} {gop}.
         """
-        system = platform.system()
-        out = str(Path(outpath).resolve())
+        system = self._screen_system
+        encode = self._screen_encode_args()
         if system == "Windows":
-            cmd = [
-                "ffmpeg",
-                "-y",
+            # gdigrab: builds without ddagrab, or a region outside the primary monitor
+            input_tpl = [
                 "-f", "gdigrab",
-                "-framerate", str(framerate),
-                "-offset_x", str(x),
-                "-offset_y", str(y),
-                "-video_size", f"{w}x{h}",
+                "-framerate", "{fps}",
+                "-offset_x", "{x}",
+                "-offset_y", "{y}",
+                "-video_size", "{w}x{h}",
+                *CAPTURE_INPUT_OPTS,
                 "-i", "desktop",
-                "-pix_fmt", "yuv420p",
-                "-c:v", "libx264",
-                "-preset", "fast",
-                "-crf", "23",
-                out
             ]
-            return cmd
+            return input_tpl, encode
         elif system == "Linux":
-            display = os.environ.get("DISPLAY", ":0.0")
-            input_str = f"{display}+{x},{y}"
-            cmd = [
-                "ffmpeg",
-                "-y",
+            input_tpl = [
                 "-f", "x11grab",
-                "-framerate", str(framerate),
-                "-video_size", f"{w}x{h}",
-                "-i", input_str,
-                "-pix_fmt", "yuv420p",
-                "-c:v", "libx264",
-                "-preset", "fast",
-                "-crf", "23",
-                out
+                "-framerate", "{fps}",
+                "-video_size", "{w}x{h}",
+                *CAPTURE_INPUT_OPTS,
+                "-i", self._display + "+{x},{y}",
             ]
-            return cmd
+            return input_tpl, encode
         elif system == "Darwin":
             screen_index = "1"
-            cmd = [
-                "ffmpeg",
-                "-y",
+            input_tpl = [
                 "-f", "avfoundation",
-                "-framerate", str(framerate),
+                "-framerate", "{fps}",
+                "-pixel_format", "uyvy422",
+                "-capture_cursor", "1",
+                "-capture_mouse_clicks", "0",
+                *CAPTURE_INPUT_OPTS,
                 "-i", f"{screen_index}",
-                "-vf", f"crop={w}:{h}:{x}:{y}",
-                "-pix_fmt", "yuv420p",
-                "-c:v", "libx264",
-                "-preset", "fast",
-                "-crf", "23",
-                out
             ]
-            return cmd
+            return input_tpl, ["-vf", "crop={w}:{h}:{x}:{y}", *encode]
         else:
             return None
 
+    def _stream_record_args(self, key, url, ts_compat=False):
+        """Return (input_args, output_args) for the Widevine stream recording (stream copy)."""
+        input_args = [
+            "-fflags", "+genpts",
+            *self._http_input_opts(url),
+            "-cenc_decryption_key", key,
+            "-i", url,
+        ]
+        # fragmented MP4: same -c copy cost as TS, smaller and seekable; TS kept for compatibility
+        if ts_compat:
+            mux = ["-f", "mpegts"]
+        else:
+            mux = ["-f", "mp4", "-movflags", "+frag_keyframe+empty_moov+default_base_moof"]
+        output_args = ["-map", "0:v:0", "-map", "0:a", "-c", "copy", *mux]
+        return input_args, output_args
+
+    def _launch_combined_ffmpeg(self, inputs, outputs, on_failed=None):
+        """
+        Start a single ffmpeg for several recordings.
+        inputs: list of input arg lists (each ending in -i ...);
+        outputs: list of (output_args, path), output_args mapping the right input.
+        """
+        cmd = [self._ffmpeg or "ffmpeg", "-y", "-hide_banner", "-loglevel", "error"]
+        for input_args in inputs:
+            cmd += input_args
+        for output_args, path in outputs:
+            cmd += [*output_args, str(path)]
+        proc = ProcRunner(cmd, self, quit_input=b"q\n")
+        if on_failed is not None:
+            proc.failed.connect(on_failed)
+        proc.start()
+        return proc
+
+    def _screen_encode_args(self, gpu_frames=False):
+        args = ["-c:v", self._screen_encoder]
+        pix_fmt = SCREEN_ENCODER_PIX_FMT.get(self._screen_encoder, "yuv420p")
+        if pix_fmt and not gpu_frames:
+            args += ["-pix_fmt", pix_fmt]
+        args += SCREEN_ENCODER_OPTS[self._screen_encoder]
+        # -fps_mode is per output (the old -vsync is global and would hit the stream copy too)
+        args += ["-g", "{gop}", "-fps_mode", "cfr", "-threads", "0"]
+        return args
+
     # ---------------- slider & UI ----------------
     def on_slider_press(self):
+        self._slider_dragging = True
         self.timer.stop()
 
     def on_slider_release(self):
         val = self.position_slider.value() / 1000.0
         self.player.set_position(val)
+        self._slider_dragging = False
         self.timer.start()
 
     def on_slider_move(self, value):
-        length = self.player.get_length() / 1000 if self.player.get_length() > 0 else 0
-        pos = (value / 1000.0) * length
-        self.time_label.setText(f"{self.format_seconds(pos)} / {self.format_seconds(length)}")
+        # sliderMoved fires per pixel: refresh the label at most every 16 ms (~60 Hz)
+        self._slider_move_value = value
+        if self._slider_move_pending:
+            return
+        self._slider_move_pending = True
+        QtCore.QTimer.singleShot(16, self._apply_slider_move)
+
+    def _apply_slider_move(self):
+        self._slider_move_pending = False
+        length = self._length_ms / 1000 if self._length_ms > 0 else 0
+        pos = (self._slider_move_value / 1000.0) * length
+        self._set_time_label(pos, length)
 
-    def update_ui(self):
-        if self.player is None:
+    def _set_time_label(self, cur, total):
+        # skip the formatting/setText when the whole seconds shown would not change
+        pair = (int(cur) if cur > 0 else 0, int(total) if total > 0 else 0)
+        if pair == self._last_label_pair:
             return
-        length_ms = self.player.get_length()
-        pos = self.player.get_position()
-        time_sec = self.player.get_time() / 1000 if self.player.get_time() != -1 else 0
-        total_sec = length_ms / 1000 if length_ms > 0 else 0
+        self._last_label_pair = pair
+        self.time_label.setText(f"{self.format_seconds(cur)} / {self.format_total(total)}")
+
+    # libVLC threads: plain attribute stores only, read later on the GUI thread
+    def _on_vlc_media_changed(self, event):
+        self._length_ms = 0
+        self._time_ms = 0
+
+    def _on_vlc_length_changed(self, event):
+        self._length_ms = event.u.new_length
+
+    def _on_vlc_time_changed(self, event):
+        self._time_ms = event.u.new_time
+
+    def _on_vlc_position(self, event):
+        # called from a libVLC thread: no Qt calls here, just hand the value over
+        self.vlc_position_changed.emit(event.u.new_position)
 
-        if pos == -1:
+    def _apply_ui(self, pos):
+        if self._slider_dragging:
+            return
+        if pos < 0:
             pos = 0
-        slider_val = int(pos * 1000)
         self.position_slider.blockSignals(True)
-        self.position_slider.setValue(slider_val)
+        self.position_slider.setValue(int(pos * 1000))
         self.position_slider.blockSignals(False)
-        self.time_label.setText(f"{self.format_seconds(time_sec)} / {self.format_seconds(total_sec)}")
+
+    def update_time_label(self):
+        # no libVLC calls: time/length come from the cached event values
+        time_sec = self._time_ms / 1000 if self._time_ms > 0 else 0
+        total_sec = self._length_ms / 1000 if self._length_ms > 0 else 0
+        self._set_time_label(time_sec, total_sec)
 
     def format_seconds(self, s: float) -> str:
+        return _fmt(0 if s is None or s != s or s < 0 else int(s))
+
+    def format_total(self, s: float) -> str:
+        # the "/ total" half rarely changes: reuse the last string while the length is the same
         s = 0 if s is None or s != s or s < 0 else int(s)
-        h = s // 3600
-        m = (s % 3600) // 60
-        sec = s % 60
-        if h:
-            return f"{h:02d}:{m:02d}:{sec:02d}"
-        return f"{m:02d}:{sec:02d}"
+        if s != self._last_total_sec:
+            self._last_total_sec = s
+            self._last_total_fmt = _fmt(s)
+        return self._last_total_fmt
+
+    def closeEvent(self, event):
+        # tools run in their own session/process group, so they would outlive the window:
+        # stop them (recorders get "q" and write their trailer) and close once all have exited
+        if self._closing_runners:
+            # already shutting down: a second click on X must not skip the wait
+            event.ignore()
+            return
+        runners = []
+        for proc in (self.ffplay_proc, self.ffmpeg_rec_proc, self.screen_rec_process):
+            if proc is None or any(proc is r for r in runners):
+                continue
+            if proc.proc is not None and proc.proc.poll() is not None:
+                continue  # already exited, nothing to wait for
+            runners.append(proc)
+        if not runners:
+            self.player.stop()
+            super().closeEvent(event)
+            return
+        self.ffplay_proc = self.ffmpeg_rec_proc = self.screen_rec_process = None
+        self._closing_runners = runners
+        sig = signal.CTRL_BREAK_EVENT if self._screen_system == "Windows" else None
+        for proc in runners:
+            proc.stopped.connect(lambda proc=proc: self._on_runner_closed(proc))
+            proc.failed.connect(lambda err, proc=proc: self._on_runner_closed(proc))
+            proc.stop(5000, sig if proc.quit_input is not None else None)
+        self.centralWidget().setEnabled(False)
+        self.status.setText("Cerrando: deteniendo ffplay/ffmpeg...")
+        event.ignore()
+
+    def _on_runner_closed(self, proc):
+        self._closing_runners = [r for r in self._closing_runners if r is not proc]
+        if not self._closing_runners:
+            # re-enter closeEvent from the event loop, not from inside this signal
+            QtCore.QTimer.singleShot(0, self.close)
 
     def eventFilter(self, obj, event):
         return super().eventFilter(obj, event)
 
+# PATH dir -> set of entry names (lower-cased on Windows), filled by the shutil_which fallback
+_dir_cache = {}
+
 # small helper (shutil.which wrapped to avoid extra import trouble)
+# cached: PATH is walked once per program; clear with shutil_which.cache_clear()
+@functools.lru_cache(maxsize=None)
 def shutil_which(prog):
     # Try shutil.which if available
     try:
         import shutil
         return shutil.which(prog)
     except Exception:
-        # fallback: search PATH
+        # fallback: one scandir per PATH dir (cached) instead of stat'ing every candidate
+        windows = platform.system() == "Windows"
+        candidates = [prog]
+        if windows:
+            candidates += [prog + ext for ext in os.environ.get("PATHEXT", ".EXE").split(os.pathsep) if ext]
         paths = os.environ.get("PATH", "").split(os.pathsep)
         for p in paths:
-            candidate = os.path.join(p, prog)
-            if os.path.exists(candidate) and os.access(candidate, os.X_OK):
-                return candidate
-            # windows .exe appended
-            if platform.system() == "Windows":
-                candidate_exe = candidate + ".exe"
-                if os.path.exists(candidate_exe) and os.access(candidate_exe, os.X_OK):
-                    return candidate_exe
+            entries = _dir_cache.get(p)
+            if entries is None:
+                try:
+                    with os.scandir(p) as it:
+                        entries = {e.name.lower() if windows else e.name for e in it}
+                except OSError:
+                    continue
+                _dir_cache[p] = entries
+            for cand in candidates:
+                if (cand.lower() if windows else cand) in entries:
+                    candidate = os.path.join(p, cand)
+                    if os.access(candidate, os.X_OK):
+                        return candidate
         return None
 
+@functools.lru_cache(maxsize=None)
+def detect_h264_encoder(ffmpeg):
+    """
+    Return the best working H.264 encoder for screen-record.
+    Builds often list nvenc/qsv without the hardware, so each candidate
+    listed by -encoders is confirmed by encoding a few blank frames with
+    the same pix_fmt/options screen-record will pass to it.
+    """
+    try:
+        listed = subprocess.run([ffmpeg, "-hide_banner", "-encoders"], capture_output=True, text=True, timeout=5).stdout
+    except Exception:
+        return "libx264"
+    for enc in HW_H264_ENCODERS:
+        if enc not in listed:
+            continue
+        pix_fmt = SCREEN_ENCODER_PIX_FMT.get(enc, "yuv420p")
+        probe = [
+            ffmpeg, "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", "color=size=256x256:duration=0.2",
+            "-frames:v", "2", "-c:v", enc,
+            *(["-pix_fmt", pix_fmt] if pix_fmt else []),
+            *SCREEN_ENCODER_OPTS[enc],
+            "-f", "null", "-",
+        ]
+        try:
+            if subprocess.run(probe, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10).returncode == 0:
+                return enc
+        except Exception:
+            pass
+    return "libx264"
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_has_filter(ffmpeg, name):
+    try:
+        listed = subprocess.run([ffmpeg, "-hide_banner", "-filters"], capture_output=True, text=True, timeout=5).stdout
+    except Exception:
+        return False
+    return re.search(rf"^\s*\S+\s+{re.escape(name)}\s", listed, re.MULTILINE) is not None
+
 def main():
     app = QtWidgets.QApplication(sys.argv)
     window = DRMMaster()